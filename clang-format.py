@@ -8,12 +8,17 @@ Distributed under the MIT software license, see the accompanying
 file COPYING or http://www.opensource.org/licenses/mit-license.php.
 '''
 
+import functools
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 import os
 import sys
 import subprocess
 
 tested_versions = ['3.6.0', '3.6.1', '3.6.2'] # A set of versions known to produce the same output
 accepted_file_extensions = ('.h', '.cpp') # Files to format
+# Number of clang-format processes to run in parallel (can be overridden using environment)
+jobs = int(os.getenv('CLANG_FORMAT_JOBS', multiprocessing.cpu_count()))
 
 def check_clang_format_version(clang_format_exe):
     try:
@@ -40,17 +45,32 @@ def check_command_line_args(argv):
         print ''
         sys.exit(1)
 
-def run_clang_format(clang_format_exe, files):
+def collect_targets(files, targets):
     for target in files:
         if os.path.isdir(target):
             for path, dirs, files in os.walk(target):
-                run_clang_format(clang_format_exe, (os.path.join(path, f) for f in files))
+                collect_targets((os.path.join(path, f) for f in files), targets)
         elif target.endswith(accepted_file_extensions):
             print "Format " + target
-            subprocess.check_call([clang_format_exe, '-i', '-style=file', target], stdout=open(os.devnull, 'wb'), stderr=subprocess.STDOUT)
+            targets.append(target)
         else:
             print "Skip " + target
 
+def format_file(clang_format_exe, target):
+    with open(os.devnull, 'wb') as devnull:
+        subprocess.check_call([clang_format_exe, '-i', '-style=file', target], stdout=devnull, stderr=subprocess.STDOUT)
+
+def run_clang_format(clang_format_exe, files):
+    targets = []
+    collect_targets(files, targets)
+    # every file is formatted by a separate clang-format process, run them in parallel
+    pool = ThreadPool(jobs)
+    try:
+        pool.map(functools.partial(format_file, clang_format_exe), targets)
+    finally:
+        pool.close()
+        pool.join()
+
 def main(argv):
     check_command_line_args(argv)
     clang_format_exe = argv[1]
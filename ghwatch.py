@@ -229,6 +229,7 @@ def draw(notifications):
 
     row = 0
     buttons = []
+    rows = []
 
     for rec in notifications:
         if rec.reason in exclude_reasons:
@@ -269,7 +270,7 @@ def draw(notifications):
             if meta['pr'] is not None and meta['pr']['merged']:
                 state = 'merged'
 
-        pr.print_row([
+        rows.append([
             (Theme.DATETIME, rec.updated_at),
             Theme.REASON_GLYPHS.get(rec.reason, Theme.UNK_REASON),
             (Theme.ROW, rec.repository.full_name),
@@ -291,6 +292,7 @@ def draw(notifications):
         if row == N:
             break
 
+    pr.print_rows(rows)
     return buttons
 
 def handle_mouse_click(b, config):
@@ -23,6 +23,7 @@ import subprocess
 import sys
 import json
 import codecs
+from concurrent.futures import ThreadPoolExecutor
 import unicodedata
 from urllib.request import Request, urlopen
 from urllib.error import HTTPError
@@ -352,14 +353,13 @@ def main():
         print(f"ERROR: Cannot find pull request {pull_reference} or branch {branch} on {host_repo_from}.", file=stderr)
         sys.exit(3)
     try:
-        subprocess.check_call([GIT,'--no-pager','log','-q','-1','refs/heads/'+head_branch], stdout=devnull, stderr=stdout)
-        head_commit = subprocess.check_output([GIT,'--no-pager','log','-1','--pretty=format:%H',head_branch]).decode('utf-8')
+        head_commit = subprocess.check_output([GIT,'rev-parse','--verify','-q','refs/heads/'+head_branch+'^{commit}']).decode('utf-8').strip()
         assert len(head_commit) == 40
     except subprocess.CalledProcessError:
         print(f"ERROR: Cannot find head of pull request {pull_reference} on {host_repo_from}.", file=stderr)
         sys.exit(3)
     try:
-        subprocess.check_call([GIT,'--no-pager','log','-q','-1','refs/heads/'+merge_branch], stdout=devnull, stderr=stdout)
+        subprocess.check_call([GIT,'cat-file','-e','refs/heads/'+merge_branch+'^{commit}'], stdout=devnull, stderr=stdout)
     except subprocess.CalledProcessError:
         print(f"ERROR: Cannot find merge of pull request {pull_reference} on {host_repo_from}.", file=stderr)
         sys.exit(3)
@@ -437,11 +437,15 @@ def main():
             sys.exit(8)
 
         # Retrieve PR comments and ACKs and add to commit message, store ACKs to print them with commit
-        # description
-        comments = retrieve_pr_comments(repo_from,pull,ghtoken) + retrieve_pr_reviews(repo_from,pull,ghtoken)
-        if comments is None:
+        # description. These are independent (paginated) requests, so fetch them concurrently.
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            comments_future = executor.submit(retrieve_pr_comments,repo_from,pull,ghtoken)
+            reviews_future = executor.submit(retrieve_pr_reviews,repo_from,pull,ghtoken)
+            comments, reviews = comments_future.result(), reviews_future.result()
+        if comments is None or reviews is None:
             print("ERROR: Could not fetch PR comments and reviews",file=stderr)
             sys.exit(1)
+        comments += reviews
         acks = get_acks_from_comments(head_commit=head_commit, comments=comments)
         message += make_acks_message(head_commit=head_commit, acks=acks)
         # end message with SHA512 tree hash, then update message
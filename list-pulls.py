@@ -22,12 +22,18 @@ notes.
 '''
 # W.J. van der Laan 2017-2021
 # SPDX-License-Identifier: MIT
+from bisect import bisect_left
+import heapq
 import subprocess
 import re
 import json
 import time
 import sys, os
 from collections import namedtuple, defaultdict
+try:
+    import orjson
+except ImportError: # fall back to (slower) standard library json module
+    orjson = None
 
 # == Global environment ==
 GIT = os.getenv('GIT', 'git')
@@ -149,14 +155,26 @@ REPO_INFO = {
     },
 }
 
-# == Utilities ==
+# Flatten label mapping to label -> (priority, category) for fast lookup
+for repo_info in REPO_INFO.values():
+    repo_info['label_to_category'] = {}
+    repo_info['category_cache'] = {}
+    for (priority, (label_list, category)) in enumerate(repo_info['label_mapping']):
+        for l in label_list:
+            repo_info['label_to_category'].setdefault(l, (priority, category))
+
+# Number the prefix variants '[prefix]:', '[prefix]' and 'prefix:' in the order
+# in which get_category tries them, and index their positions by variant
+for repo_info in REPO_INFO.values():
+    repo_info['prefix_variants'] = []
+    repo_info['prefix_variant_pos'] = defaultdict(list)
+    for (prefix, category, do_strip) in repo_info['prefixes']:
+        assert(not set(prefix) & set('[]:')) # get_category relies on this to find the candidate variants
+        for variant in [('[' + prefix + ']:'), ('[' + prefix + ']'), (prefix + ':')]:
+            repo_info['prefix_variant_pos'][variant].append(len(repo_info['prefix_variants']))
+            repo_info['prefix_variants'].append((variant, prefix, category, do_strip))
 
-def remove_last_if_empty(l):
-    '''Remove empty last member of list'''
-    if l[-1]==b'' or l[-1]=='':
-        return l[0:-1]
-    else:
-        return l
+# == Utilities ==
 
 # Valid chars in github names
 VALIDNAMECHARS = '[0-9a-zA-Z\-_]'
@@ -235,25 +253,74 @@ if len(sys.argv) >= 4:
         print(f'Unable to read exclude file {exclude_file}', file=sys.stderr)
         exit(1)
 
-# set of all commits
-commits = subprocess.check_output([GIT, 'rev-list', '--reverse', '--topo-order', ref_from+'..'+ref_to])
-commits = commits.decode()
-commits = remove_last_if_empty(commits.splitlines())
-commits_list = commits
-commits = set(commits)
+# list of all commits
+# file descriptors are non-inheritable by default, so there is no need to have
+# subprocess close them all in the child
+rev_list_args = [GIT, 'rev-list', '--reverse', '--topo-order', ref_from+'..'+ref_to]
+with subprocess.Popen(rev_list_args, stdout=subprocess.PIPE, text=True, close_fds=False) as p:
+    commits_list = [line.rstrip('\n') for line in p.stdout]
+if p.returncode:
+    raise subprocess.CalledProcessError(p.returncode, rev_list_args)
+# position of every commit in (reverse topological) commits list
+commit_index = {sha: i for i, sha in enumerate(commits_list)}
 
 CommitData = namedtuple('CommitData', ['sha', 'message', 'title', 'parents'])
 commit_data = {}
 
 # collect data
-for commit in commits:
-    info = subprocess.check_output([GIT, 'show', '-s', '--format=%B%x00%P', commit])
-    info = info.decode()
-    (message, parents) = info.split('\0')
+# request all commits from a single git log invocation (NUL-terminated records)
+# this is much faster than launching git show per commit
+log = subprocess.check_output([GIT, 'log', '-z', '--format=%H%n%P%n%B', ref_from+'..'+ref_to], close_fds=False)
+for record in log.decode().split('\0'):
+    if not record:
+        continue
+    (commit, parents, message) = record.split('\n', 2)
     title = message.rstrip().splitlines()[0]
     parents = parents.rstrip().split(' ')
     commit_data[commit] = CommitData(commit, message, title, parents)
 
+# flags for merged_commits
+FIRST_PARENT = 1
+SECOND_PARENT = 2
+
+def merged_commits(parents):
+    '''
+    Return set of commits in the range reachable from the second parent but
+    not from the first, the equivalent of git rev-list parents[0]..parents[1].
+    Commits in the range can only be reached through other commits in the
+    range, so walking commit_data is enough.
+    '''
+    flags = {}
+    heap = []
+    unique = 0 # number of queued commits only reachable from the second parent
+    def mark(sha, flag):
+        nonlocal unique
+        index = commit_index.get(sha)
+        if index is None:
+            return
+        old = flags.get(sha, 0)
+        if old == 0:
+            heapq.heappush(heap, (-index, sha))
+            unique += flag == SECOND_PARENT
+        elif old == SECOND_PARENT and flag & FIRST_PARENT:
+            unique -= 1
+        flags[sha] = old | flag
+
+    mark(parents[0], FIRST_PARENT)
+    mark(parents[1], SECOND_PARENT)
+    # paint down in descending position: ancestors of a commit always sort
+    # before it, so its flags are final once it is popped
+    result = set()
+    while unique:
+        (_, sha) = heapq.heappop(heap)
+        flag = flags[sha]
+        if flag == SECOND_PARENT:
+            unique -= 1
+            result.add(sha)
+        for parent in commit_data[sha].parents:
+            mark(parent, flag)
+    return result
+
 class CommitMetaData:
     pull = None
     rebased_from = None
@@ -266,14 +333,18 @@ def parse_commit_message(msg):
     Parse backport commit message.
     '''
     retval = CommitMetaData()
-    for line in msg.splitlines():
-        if line.startswith('Github-Pull:'):
+    # trailers are at the end of the message, scan backwards so that we can
+    # stop as soon as both are found (the last occurrence wins)
+    for line in reversed(msg.splitlines()):
+        if retval.pull is None and line.startswith('Github-Pull:'):
             param = line[12:].strip()
             if param.startswith('#'): # compensate for incorrect #bitcoin-core/gui#148
                 param = param[1:]
             retval.pull = FQId.parse(param, DEFAULT_REPO)
-        if line.startswith('Rebased-From:'):
+        if retval.rebased_from is None and line.startswith('Rebased-From:'):
             retval.rebased_from = line[13:].strip().split()
+        if retval.pull is not None and retval.rebased_from is not None:
+            break
     if retval.pull is not None:
         return retval
     else:
@@ -282,7 +353,7 @@ def parse_commit_message(msg):
 # traverse merge commits
 pulls = {}
 PullData = namedtuple('PullData', ['id', 'merge', 'commits', 'index'])
-orphans = set(commits)
+orphans = set(commits_list)
 MERGE_RE = re.compile('Merge (.*?):')
 for c in commit_data.values():
     # is merge commit
@@ -293,13 +364,9 @@ for c in commit_data.values():
             if c.sha in orphans:
                 orphans.remove(c.sha)
             #print('removing ', c.sha)
-            sub_commits = subprocess.check_output([GIT, 'rev-list', c.parents[0]+'..'+c.parents[1]])
-            sub_commits = sub_commits.decode()
-            sub_commits = set(sub_commits.rstrip().splitlines())
+            sub_commits = merged_commits(c.parents)
             pull = FQId.parse(match.group(1), DEFAULT_REPO)
 
-            # remove commits that are not in the global list
-            sub_commits = sub_commits.intersection(commits)
             for cs in sub_commits:
                 if cs in orphans:
                     orphans.remove(cs)
@@ -308,7 +375,7 @@ for c in commit_data.values():
                 # if any sub-commits left, report them
                 if sub_commits:
                     # only report pull if any new commit went into the release
-                    index = commits_list.index(c.sha)
+                    index = commit_index[c.sha]
                     pulls[pull] = PullData(pull, c.sha, sub_commits, index)
 
                     # look up commits and see if they point to master pulls
@@ -330,12 +397,10 @@ for c in commit_data.values():
             print(f'{c.sha}: Merge commit does not merge a PR: {c.title}')
 
 # Extract remaining pull numbers from orphans, if they're backports
-for o in set(orphans):
-    c = commit_data[o]
-    md = parse_commit_message(commit_data[o].message)
-    if md:
-        pulls[md.pull] = PullData(md.pull, c.sha, [], commits_list.index(c.sha))
-        orphans.remove(o)
+matched = [(o, md) for o in orphans for md in (parse_commit_message(commit_data[o].message),) if md]
+for (o, md) in matched:
+    pulls[md.pull] = PullData(md.pull, o, [], commit_index[o])
+orphans -= {o for (o, _) in matched}
 
 # Sort by index in commits list
 # This results in approximately chronological order
@@ -348,12 +413,14 @@ def guess_category_from_labels(repo_info, labels):
     '''
     Guess category for a PR from github labels.
     '''
-    labels = [l.lower() for l in labels]
-    for (label_list, category) in repo_info['label_mapping']:
-        for l in labels:
-            if l in label_list:
-                return category
-    return repo_info['default_category']
+    labels = frozenset(l.lower() for l in labels)
+    # many PRs share the same set of labels
+    category_cache = repo_info['category_cache']
+    if labels not in category_cache:
+        label_to_category = repo_info['label_to_category']
+        best = min((label_to_category[l] for l in labels if l in label_to_category), default=None)
+        category_cache[labels] = best[1] if best is not None else repo_info['default_category']
+    return category_cache[labels]
 
 def get_category(repo_info, labels, message):
     '''
@@ -363,16 +430,58 @@ def get_category(repo_info, labels, message):
     category = guess_category_from_labels(repo_info, labels)
     message = message.strip()
 
-    for (prefix, p_category, do_strip) in repo_info['prefixes']:
-        for variant in [('[' + prefix + ']:'), ('[' + prefix + ']'), (prefix + ':')]:
-            if message.lower().startswith(variant):
-                category = p_category
-                message = message[len(variant):].lstrip()
-                if not do_strip: # if strip is not requested, re-add prefix in sanitized way
-                    message = prefix + ': ' + message.capitalize()
+    # equivalent to trying every variant of every prefix in order with
+    # message.lower().startswith(variant), but as prefixes contain no '[', ']'
+    # or ':', the only variants that can match are the message up to and
+    # including the first ']' (optionally followed by ':') or the first ':'
+    variants = repo_info['prefix_variants']
+    variant_pos = repo_info['prefix_variant_pos']
+    pos = 0
+    while True:
+        lower = message.lower()
+        bracket = lower[:lower.find(']') + 1]
+        colon = lower[:lower.find(':') + 1]
+        next_pos = None
+        for candidate in (bracket and bracket + ':', bracket, colon):
+            if candidate in variant_pos and lower.startswith(candidate):
+                # first position of this variant that was not tried yet
+                positions = variant_pos[candidate]
+                i = bisect_left(positions, pos)
+                if i < len(positions) and (next_pos is None or positions[i] < next_pos):
+                    next_pos = positions[i]
+        if next_pos is None:
+            break
+        (variant, prefix, p_category, do_strip) = variants[next_pos]
+        pos = next_pos + 1
+        category = p_category
+        message = message[len(variant):].lstrip()
+        if not do_strip: # if strip is not requested, re-add prefix in sanitized way
+            message = prefix + ': ' + message.capitalize()
 
     return (category, message)
 
+ghmeta_dirs = {}
+def read_ghmeta(base, pr, suffix):
+    '''
+    Read github metadata JSON file for a PR, return None if not available.
+    Directory listings are cached, so that files that are not there don't
+    have to be opened.
+    '''
+    dirname = f'{base}/issues/{pr//100}xx'
+    if dirname not in ghmeta_dirs:
+        try:
+            ghmeta_dirs[dirname] = set(os.listdir(dirname))
+        except OSError:
+            ghmeta_dirs[dirname] = set()
+    name = f'{pr}{suffix}.json'
+    if name not in ghmeta_dirs[dirname]:
+        return None
+    try:
+        with open(f'{dirname}/{name}', 'rb') as f:
+            return (orjson or json).loads(f.read())
+    except IOError as e:
+        return None
+
 pull_meta = {}
 pull_labels = {}
 per_category = defaultdict(list)
@@ -383,19 +492,8 @@ for pull in pulls_order:
     data0 = None
     data1 = {'title': '{Not found}', 'user': {'login':'unknown'}}
     if repo_info['ghmeta'] is not None:
-        filename = f'{repo_info["ghmeta"]}/issues/{pull.pr//100}xx/{pull.pr}.json'
-        try:
-            with open(filename, 'r') as f:
-                data0 = json.load(f)
-        except IOError as e:
-            pass
-
-        filename = f'{repo_info["ghmeta"]}/issues/{pull.pr//100}xx/{pull.pr}-PR.json'
-        try:
-            with open(filename, 'r') as f:
-                data1 = json.load(f)
-        except IOError as e:
-            pass
+        data0 = read_ghmeta(repo_info['ghmeta'], pull.pr, '')
+        data1 = read_ghmeta(repo_info['ghmeta'], pull.pr, '-PR') or data1
 
     message = data1['title']
     author = data1['user']['login']
@@ -405,7 +503,9 @@ for pull in pulls_order:
         labels = ['Missing']
 
     # nightmarish UTF tweaking to fix broken output of export script
-    message = message.encode('ISO-8859-1', errors='replace').decode(errors='replace')
+    # (a no-op for pure ASCII titles, which are the majority)
+    if not message.isascii():
+        message = message.encode('ISO-8859-1', errors='replace').decode(errors='replace')
 
     # consistent ellipsis
     message = message.replace('...', '…')
@@ -421,29 +521,28 @@ for pull in pulls_order:
     pull_labels[pull] = labels 
     pull_meta[pull] = data1
     
+# collect output, then write it at once
+parts = []
 for _,category in LABEL_MAPPING:
     if not per_category[category]:
         continue
-    print('### %s' % category)
-    for dd in per_category[category]:
-        print(f'- {dd[0]} {dd[1]} ({dd[2]})')
-    print()
+    parts.append(f'### {category}\n')
+    parts.extend(f'- {dd[0]} {dd[1]} ({dd[2]})\n' for dd in per_category[category])
+    parts.append('\n')
 
 if per_category[UNCATEGORIZED]:
-    print('### %s' % UNCATEGORIZED)
-    for dd in per_category[UNCATEGORIZED]:
-        print(f'- {dd[0]} {dd[1]} ({dd[2]}) (labels: {pull_labels[dd[0]]})')
-    print()
+    parts.append(f'### {UNCATEGORIZED}\n')
+    parts.extend(f'- {dd[0]} {dd[1]} ({dd[2]}) (labels: {pull_labels[dd[0]]})\n' for dd in per_category[UNCATEGORIZED])
+    parts.append('\n')
 
-print('### Orphan commits')
-for o in orphans:
-    c = commit_data[o]
-    print('- `%s` %s' % (o[0:7], c.title))
+parts.append('### Orphan commits\n')
+parts.extend(f'- `{o[0:7]}` {commit_data[o].title}\n' for o in orphans)
+sys.stdout.write(''.join(parts))
 
 # write to json structure for postprocessing
 commits_d = []
 for c in commits_list:
-    commits_d.append(commit_data[c])
+    commits_d.append(list(commit_data[c]))
 
 pulls_d = []
 for pull in sorted(pulls.keys()):
@@ -460,7 +559,9 @@ data_out = {
     'orphans': list(orphans),
 }
 
+# always use the standard library encoder, so that the output is the same
+# whether or not orjson is installed (the file is used as exclude file later)
 with open('pulls.json','w') as f:
-    json.dump(data_out, f, sort_keys=True,
-                           indent=4, separators=(',', ': '))
+    f.write(json.dumps(data_out, sort_keys=True,
+                       indent=4, separators=(',', ': ')))
 
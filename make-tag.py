@@ -17,6 +17,11 @@ GIT = os.getenv("GIT", "git")
 # Full version specification
 VersionSpec = collections.namedtuple('VersionSpec', ['major', 'minor', 'build', 'rc'])
 
+# For parsing version tags
+TAG_RE = re.compile(r"^v([0-9]+)\.([0-9]+)(?:\.([0-9]+))?(?:rc([0-9])+)?$")
+# For parsing version defines from configure.ac
+CONFIGURE_AC_VERSION_RE = re.compile(r"^define\(_CLIENT_VERSION_([A-Z_]+), ([0-9a-z]+)\)", re.MULTILINE)
+
 def version_name(spec):
     '''
     Short version name for comparison.
@@ -38,7 +43,7 @@ def parse_tag(tag):
     - v1.2rc3
     - v1.2.3rc4
     '''
-    m = re.match("^v([0-9]+)\.([0-9]+)(?:\.([0-9]+))?(?:rc([0-9])+)?$", tag)
+    m = TAG_RE.match(tag)
 
     if m is None:
         print(f"Invalid tag {tag}", file=sys.stderr)
@@ -67,13 +72,9 @@ def check_configure_ac(spec):
     Parse configure.ac and return
     (major, minor, build, rc)
     '''
-    info = {}
     filename = 'configure.ac'
     with open(filename) as f:
-        for line in f:
-            m = re.match("define\(_CLIENT_VERSION_([A-Z_]+), ([0-9a-z]+)\)", line)
-            if m:
-                info[m.group(1)] = m.group(2)
+        info = dict(CONFIGURE_AC_VERSION_RE.findall(f.read()))
     # check if IS_RELEASE is set
     if info["IS_RELEASE"] != "true":
         print(f'{filename}: IS_RELEASE is not set to true', file=sys.stderr)
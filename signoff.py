@@ -6,6 +6,7 @@ then gpg-sign it.
 from treehash512 import tree_sha512sum, GIT
 import subprocess, sys
 HDR = b'Tree-SHA512'
+HDR_COLON = HDR + b':'
 def main():
     commit = 'HEAD'
     h = tree_sha512sum(commit).encode()
@@ -13,9 +14,9 @@ def main():
 
     curh = None
     for line in msg.splitlines():
-        if line.startswith(HDR+b':'):
+        if line.startswith(HDR_COLON):
             assert(curh is None) # no multiple treehashes
-            curh = line[len(HDR)+1:].strip()
+            curh = line[len(HDR_COLON):].strip()
 
     if curh == h:
         print('Warning: already has a (valid) treehash')
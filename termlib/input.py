@@ -1,6 +1,8 @@
 '''
 Terminal input handling (based on bpytop).
 '''
+import codecs
+from collections import deque
 import fcntl
 import logging
 import os
@@ -8,9 +10,9 @@ from select import select
 import signal
 import sys
 import termios
-import threading
+from time import monotonic
 import tty
-from typing import List, Set, Dict, Tuple, Optional, Union, Any, Callable, ContextManager, Iterable, Type, NamedTuple
+from typing import Deque, List, Set, Dict, Tuple, Optional, Union, Any, Callable, ContextManager, Iterable, Type, NamedTuple
 
 errlog = logging.getLogger("ErrorLogger")
 errlog.setLevel(logging.DEBUG)
@@ -38,20 +40,17 @@ class Raw(object):
     def __exit__(self, type, value, traceback):
         termios.tcsetattr(self.stream, termios.TCSANOW, self.original_stty)
 
-class Nonblocking(object):
-    """Set nonblocking mode for device"""
-    def __init__(self, stream):
-        self.stream = stream
-        self.fd = self.stream.fileno()
-    def __enter__(self):
-        self.orig_fl = fcntl.fcntl(self.fd, fcntl.F_GETFL)
-        fcntl.fcntl(self.fd, fcntl.F_SETFL, self.orig_fl | os.O_NONBLOCK)
-    def __exit__(self, *args):
-        fcntl.fcntl(self.fd, fcntl.F_SETFL, self.orig_fl)
+def group_by_first_char(escape):
+    """Group escape codes by their first character, keeping dict order"""
+    grouped: Dict[str, List[Tuple[str, str]]] = {}
+    for codes, name in escape.items():
+        for code in (codes if isinstance(codes, tuple) else (codes,)):
+            grouped.setdefault(code[0], []).append((code, name))
+    return grouped
 
 class Key:
-    """Handles the threaded input reader for keypresses and mouse events"""
-    list: List[str] = []
+    """Handles signal-driven (SIGIO) input for keypresses and mouse events"""
+    list: Deque[str] = deque(maxlen=10)                      #* Up to 10 keys in input queue, oldest are dropped
     mouse: Dict[str, List[List[int]]] = {}
     mouse_pos: Tuple[int, int] = (0, 0)
     escape: Dict[Union[str, Tuple[str, str]], str] = {
@@ -82,21 +81,38 @@ class Key:
         "[23" :                   "f11",
         "[24" :                   "f12"
         }
-    new = threading.Event()
-    idle = threading.Event()
-    mouse_move = threading.Event()
+    escape_by_first: Dict[str, List[Tuple[str, str]]] = group_by_first_char(escape)
+    mouse_events: Dict[str, str] = {
+        "\033[<0" :              "mouse_click",
+        "\033[<35" :             "mouse_move",
+        "\033[<64" :             "mouse_scroll_up",
+        "\033[<65" :             "mouse_scroll_down"
+        }
+    mouse_move: bool = False
     mouse_report: bool = False
-    idle.set()
-    stopping: bool = False
     started: bool = False
-    reader: threading.Thread
+    raw: Raw
+    orig_fl: int
+    decoder: codecs.IncrementalDecoder
+    wake_r: int                                                 #* Signal wakeup pipe, lets input_wait notice SIGIO/SIGWINCH
+    wake_w: int
 
     @classmethod
     def start(cls, hide_cursor=False):
+        fd = sys.stdin.fileno()
+        cls.decoder = codecs.getincrementaldecoder(sys.stdin.encoding or "utf-8")(errors="replace")
+        cls.raw = Raw(sys.stdin)
+        cls.raw.__enter__()
+        cls.wake_r, cls.wake_w = os.pipe()
+        os.set_blocking(cls.wake_r, False)
+        os.set_blocking(cls.wake_w, False)
+        signal.set_wakeup_fd(cls.wake_w, warn_on_full_buffer=False)    #* Only used to wake up input_wait, a full pipe is fine
         signal.signal(signal.SIGWINCH, cls._resize_handler)
-        cls.stopping = False
-        cls.reader = threading.Thread(target=cls._get_key)
-        cls.reader.start()
+        signal.signal(signal.SIGIO, cls._on_input)
+        # Don't set O_NONBLOCK here: on a terminal stdin shares its file description with stdout
+        cls.orig_fl = fcntl.fcntl(fd, fcntl.F_GETFL)
+        fcntl.fcntl(fd, fcntl.F_SETOWN, os.getpid())
+        fcntl.fcntl(fd, fcntl.F_SETFL, cls.orig_fl | os.O_ASYNC)
         cls.started = True
         sys.stdout.write(Term.mouse_on)
         if hide_cursor:
@@ -107,12 +123,14 @@ class Key:
     def stop(cls):
         sys.stdout.write(Term.mouse_off + Term.show_cursor)
         sys.stdout.flush()
-        if cls.started and cls.reader.is_alive():
-            cls.stopping = True
-            try:
-                cls.reader.join()
-            except:
-                pass
+        if cls.started:
+            fcntl.fcntl(sys.stdin.fileno(), fcntl.F_SETFL, cls.orig_fl) #* Disable SIGIO before restoring its default (terminating) action
+            signal.signal(signal.SIGIO, signal.SIG_DFL)
+            signal.set_wakeup_fd(-1)
+            cls.raw.__exit__(None, None, None)
+            os.close(cls.wake_r)
+            os.close(cls.wake_w)
+            cls.started = False
 
     @classmethod
     def last(cls) -> str:
@@ -121,19 +139,17 @@ class Key:
 
     @classmethod
     def get(cls) -> str:
-        if cls.list: return cls.list.pop(0)
+        if cls.list: return cls.list.popleft()
         else: return ""
 
     @classmethod
     def get_mouse(cls) -> Tuple[int, int]:
-        if cls.new.is_set():
-            cls.new.clear()
         return cls.mouse_pos
 
     @classmethod
     def mouse_moved(cls) -> bool:
-        if cls.mouse_move.is_set():
-            cls.mouse_move.clear()
+        if cls.mouse_move:
+            cls.mouse_move = False
             return True
         else:
             return False
@@ -144,92 +160,100 @@ class Key:
 
     @classmethod
     def clear(cls):
-        cls.list = []
+        cls.list.clear()
 
     @classmethod
     def input_wait(cls, sec: float = 0.0, mouse: bool = False) -> bool:
         '''Returns True if key is detected else waits out timer and returns False'''
+        cls._read_input()                                           #* Pick up anything typed since the last call
         if cls.list: return True
         if mouse: Draw.now(Term.mouse_direct_on)
-        cls.new.wait(sec if sec > 0 else 0.0)
+        deadline = monotonic() + sec
+        while not cls.list and not cls.mouse_move:                  #* The wakeup pipe interrupts select on SIGIO and SIGWINCH
+            timeout = deadline - monotonic()
+            if timeout <= 0:
+                break
+            if select([cls.wake_r], [], [], timeout)[0]:
+                while True:
+                    try:
+                        os.read(cls.wake_r, 64)
+                    except BlockingIOError:
+                        break
+                cls._read_input()
         if mouse: Draw.now(Term.mouse_direct_off, Term.mouse_on)
 
-        if cls.new.is_set():
-            cls.new.clear()
-            return True
-        else:
-            return False
+        return bool(cls.list) or cls.mouse_move
 
     @classmethod
     def break_wait(cls):
         cls.list.append("_null")
-        cls.new.set()
-        sleep(0.01)
-        cls.new.clear()
 
     @classmethod
     def _resize_handler(cls, signum, frame):
         cls.list.append('resize')
-        cls.new.set()
-        
-    @classmethod
-    def _get_key(cls):
-        """Get a key or escape sequence from stdin, convert to readable format and save to keys list. Meant to be run in it's own thread."""
-        input_key: str = ""
-        clean_key: str = ""
-        try:
-            while not cls.stopping:
-                with Raw(sys.stdin):
-                    if not select([sys.stdin], [], [], 0.1)[0]:            #* Wait 100ms for input on stdin then restart loop to check for stop flag
-                        continue
-                    input_key += sys.stdin.read(1)                        #* Read 1 key safely with blocking on
-                    if input_key == "\033":                                #* If first character is a escape sequence keep reading
-                        cls.idle.clear()                                #* Report IO block in progress to prevent Draw functions from getting a IO Block error
-                        # Draw.idle.wait()                                #* Wait for Draw function to finish if busy
-                        with Nonblocking(sys.stdin):                     #* Set non blocking to prevent read stall
-                            input_key += sys.stdin.read(20)
-                            if input_key.startswith("\033[<"):
-                                _ = sys.stdin.read(1000)
-                        cls.idle.set()                                    #* Report IO blocking done
-                    #errlog.debug(f'{repr(input_key)}')
-                    if input_key == "\033":    clean_key = "escape"        #* Key is "escape" key if only containing \033
-                    elif input_key.startswith(("\033[<0;", "\033[<35;", "\033[<64;", "\033[<65;")): #* Detected mouse event
-                        try:
-                            cls.mouse_pos = (int(input_key.split(";")[1]) - 1, int(input_key.split(";")[2].rstrip("mM")) - 1)
-                        except:
-                            pass
-                        else:
-                            if input_key.startswith("\033[<35;"):        #* Detected mouse move in mouse direct mode
-                                    cls.mouse_move.set()
-                                    cls.new.set()
-                            elif input_key.startswith("\033[<64;"):        #* Detected mouse scroll up
-                                clean_key = "mouse_scroll_up"
-                            elif input_key.startswith("\033[<65;"):        #* Detected mouse scroll down
-                                clean_key = "mouse_scroll_down"
-                            elif input_key.startswith("\033[<0;") and input_key.endswith("m"): #* Detected mouse click release
-                                clean_key = "mouse_click"
-                    elif input_key == "\\": clean_key = "\\"            #* Clean up "\" to not return escaped
-                    else:
-                        for code in cls.escape.keys():                    #* Go trough dict of escape codes to get the cleaned key name
-                            if input_key.lstrip("\033").startswith(code):
-                                clean_key = cls.escape[code]
-                                break
-                        else:                                            #* If not found in escape dict and length of key is 1, assume regular character
-                            if len(input_key) == 1:
-                                clean_key = input_key
-                    if clean_key:
-                        cls.list.append(clean_key)                        #* Store up to 10 keys in input queue for later processing
-                        if len(cls.list) > 10: del cls.list[0]
-                        clean_key = ""
-                        cls.new.set()                                    #* Set threading event to interrupt main thread sleep
-                    input_key = ""
 
+    @classmethod
+    def _on_input(cls, signum, frame):
+        """SIGIO handler, does nothing: only needed so that the signal is written to the wakeup pipe."""
+        pass
 
+    @classmethod
+    def _read_input(cls):
+        """Read all pending input from stdin and split it into keys and escape sequences."""
+        try:
+            fd = sys.stdin.fileno()
+            data: str = ""
+            while select([fd], [], [], 0)[0]:                           #* SIGIO also fires for output, only read what is there
+                chunk = os.read(fd, 1024)
+                if not chunk:
+                    break
+                data += cls.decoder.decode(chunk)
+            i = 0
+            while i < len(data):
+                if data[i] == "\033":                                   #* If first character is a escape sequence take up to 20 more
+                    input_key = data[i:i + 21]
+                    i += 21
+                    if input_key.startswith("\033[<"):
+                        i += 1000                                         #* Drop queued-up mouse reports
+                else:
+                    input_key = data[i]
+                    i += 1
+                cls._process_key(input_key)
         except Exception as e:
-            errlog.exception(f'Input thread failed with exception: {e}')
-            cls.idle.set()
+            errlog.exception(f'Input handler failed with exception: {e}')
             cls.list.clear()
-            clean_quit(1, thread=True)
+            clean_quit(1)
+
+    @classmethod
+    def _process_key(cls, input_key: str):
+        """Convert a key or escape sequence to readable format and save to keys list."""
+        clean_key: str = ""
+        #errlog.debug(f'{repr(input_key)}')
+        input_parts = input_key.split(";", 3)                #* Mouse events are "\033[<button;x;y" followed by "M" or "m"
+        if input_key == "\033":    clean_key = "escape"        #* Key is "escape" key if only containing \033
+        elif input_parts[0] in cls.mouse_events:            #* Detected mouse event
+            try:
+                cls.mouse_pos = (int(input_parts[1]) - 1, int(input_parts[2].rstrip("mM")) - 1)
+            except:
+                pass
+            else:
+                mouse_event = cls.mouse_events[input_parts[0]]
+                if mouse_event == "mouse_move":                #* Detected mouse move in mouse direct mode
+                    cls.mouse_move = True
+                elif mouse_event != "mouse_click" or input_key.endswith("m"): #* Detected mouse scroll, or mouse click release
+                    clean_key = mouse_event
+        elif input_key == "\\": clean_key = "\\"            #* Clean up "\" to not return escaped
+        else:
+            stripped_key = input_key.lstrip("\033")
+            for code, name in cls.escape_by_first.get(stripped_key[:1], ()): #* Go trough escape codes with matching first character to get the cleaned key name
+                if stripped_key.startswith(code):
+                    clean_key = name
+                    break
+            else:                                            #* If not found in escape dict and length of key is 1, assume regular character
+                if len(input_key) == 1:
+                    clean_key = input_key
+        if clean_key:
+            cls.list.append(clean_key)                        #* Store up to 10 keys in input queue for later processing
 
-def clean_quit(errcode: int = 0, errmsg: str = "", thread: bool = False):
+def clean_quit(errcode: int = 0, errmsg: str = ""):
     sys.exit(1)
@@ -17,20 +17,37 @@ W = {
 'N': 1,  #neutral; not used in Asian text, so has no width. Practically, width can be considered as 1
 }
 
+# Precomputed width per code point in the basic multilingual plane
+WIDTH_TABLE = bytes(W[unicodedata.east_asian_width(chr(c))] for c in range(0x10000))
+
+def char_width(ch):
+    '''Visual width of a single character.'''
+    c = ord(ch)
+    if c < 0x10000:
+        return WIDTH_TABLE[c]
+    return W[unicodedata.east_asian_width(ch)]
+
 def get_width(s):
     # TODO:
     # - Handle embedded attributes
-    return sum(W[unicodedata.east_asian_width(ch)] for ch in s)
+    if s.isascii(): # every ASCII character has width 1
+        return len(s)
+    if max(s, default='') < '\U00010000': # only BMP characters, use table directly
+        return sum(map(WIDTH_TABLE.__getitem__, map(ord, s)))
+    return sum(map(char_width, s))
 
 def crop(s, width):
     '''Crop a string to a certain visual length.'''
     # TODO:
     # - Handle embedded attributes
     # - Ellipsis … ?
+    if s.isascii(): # every ASCII character has width 1
+        l = max(min(len(s), width), 0)
+        return (s[0:l], l)
     o = 0
     l = 0
     for ch in s:
-        w = W[unicodedata.east_asian_width(ch)]
+        w = char_width(ch)
         if l + w > width:
             break
         l += w
@@ -59,23 +76,43 @@ class Column:
 ColumnInfo = namedtuple('ColumnInfo', ['x', 'width'])
 
 class TablePrinter:
-    def __init__(self, out, attr, columns):
+    def __init__(self, out, attr, columns, binary=False):
+        '''
+        If binary is set, output is encoded to UTF-8 once per write and
+        written to the underlying binary buffer of out, bypassing its
+        text layer.
+        '''
         self.out = out
+        self.binary = binary
         self.attr = attr
         self.columns = columns
+        # x position of every column, including separators
+        self.column_x = []
+        x = 0
+        for col in columns:
+            self.column_x.append(x)
+            x += col.width + 1
 
     def format_row(self, rec):
         return ' '.join((entry[0] + pad(str(entry[1]), col.width, col.align) + self.attr.close(entry[0]) for entry, col in zip(rec, self.columns)))
 
+    def write(self, s):
+        if self.binary:
+            self.out.flush() # keep order with text written to out directly
+            self.out.buffer.write(s.encode('utf-8'))
+        else:
+            self.out.write(s)
+
     def print_row(self, rec):
-        self.out.write(f'{self.format_row(rec)}\n')
+        self.write(f'{self.format_row(rec)}\n')
+
+    def print_rows(self, recs):
+        '''Print multiple rows with a single write.'''
+        self.write(''.join(f'{self.format_row(rec)}\n' for rec in recs))
 
     def print_header(self, hdr_attr):
         titles = [(hdr_attr, t.title) for t in self.columns]
-        self.out.write(f'{self.format_row(titles)}\n')
+        self.write(f'{self.format_row(titles)}\n')
 
     def column_info(self, idx):
-        x = 0
-        for i in range(0, idx):
-            x += self.columns[i].width + 1
-        return ColumnInfo(x=x, width=self.columns[idx].width)
+        return ColumnInfo(x=self.column_x[idx], width=self.columns[idx].width)
@@ -19,51 +19,53 @@ import subprocess
 
 # External tools (can be overridden using environment)
 GIT = os.getenv('GIT','git')
+# Number of blobs to request from git-cat-file at once. The requests for one batch
+# have to fit in the pipe buffer (64 KiB on Linux), or writing them can deadlock.
+BATCH_SIZE = 256
 
 def tree_sha512sum(commit='HEAD'):
     # request metadata for entire tree, recursively
-    files = []
-    blob_by_name = {}
+    entries = [] # (name, blobid)
     for line in subprocess.check_output([GIT, 'ls-tree', '--full-tree', '-r', commit]).splitlines():
         name_sep = line.index(b'\t')
         metadata = line[:name_sep].split() # perms, 'blob', blobid
         assert(metadata[1] == b'blob')
         name = line[name_sep+1:]
-        files.append(name)
-        blob_by_name[name] = metadata[2]
+        entries.append((name, metadata[2]))
 
-    files.sort()
+    entries.sort() # names are unique, so this sorts by name
     # open connection to git-cat-file in batch mode to request data for all blobs
     # this is much faster than launching it per file
     p = subprocess.Popen([GIT, 'cat-file', '--batch'], stdout=subprocess.PIPE, stdin=subprocess.PIPE)
     overall = hashlib.sha512()
-    for f in files:
-        blob = blob_by_name[f]
-        # request blob
-        p.stdin.write(blob + b'\n')
+    for start in range(0, len(entries), BATCH_SIZE):
+        batch = entries[start:start + BATCH_SIZE]
+        # request a batch of blobs at once, instead of waiting for a round-trip per file
+        p.stdin.write(b''.join(blob + b'\n' for _, blob in batch))
         p.stdin.flush()
-        # read header: blob, "blob", size
-        reply = p.stdout.readline().split()
-        assert(reply[0] == blob and reply[1] == b'blob')
-        size = int(reply[2])
-        # hash the blob data
-        intern = hashlib.sha512()
-        ptr = 0
-        while ptr < size:
-            bs = min(65536, size - ptr)
-            piece = p.stdout.read(bs)
-            if len(piece) == bs:
-                intern.update(piece)
-            else:
-                raise IOError('Premature EOF reading git cat-file output')
-            ptr += bs
-        dig = intern.hexdigest()
-        assert(p.stdout.read(1) == b'\n') # ignore LF that follows blob data
-        # update overall hash with file hash
-        overall.update(dig.encode("utf-8"))
-        overall.update("  ".encode("utf-8"))
-        overall.update(f)
-        overall.update("\n".encode("utf-8"))
+        for f, blob in batch:
+            # read header: blob, "blob", size
+            reply = p.stdout.readline().split()
+            assert(reply[0] == blob and reply[1] == b'blob')
+            size = int(reply[2])
+            # hash the blob data
+            intern = hashlib.sha512()
+            ptr = 0
+            while ptr < size:
+                bs = min(65536, size - ptr)
+                piece = p.stdout.read(bs)
+                if len(piece) == bs:
+                    intern.update(piece)
+                else:
+                    raise IOError('Premature EOF reading git cat-file output')
+                ptr += bs
+            dig = intern.hexdigest()
+            assert(p.stdout.read(1) == b'\n') # ignore LF that follows blob data
+            # update overall hash with file hash
+            overall.update(dig.encode("utf-8"))
+            overall.update("  ".encode("utf-8"))
+            overall.update(f)
+            overall.update("\n".encode("utf-8"))
     p.stdin.close()
     if p.wait():
         raise IOError('Non-zero return value executing git cat-file')
@@ -4,6 +4,10 @@ import sys
 import re
 import os
 
+LEAVING_TEST_CASE_RE = re.compile(rb'Leaving test case "(.*)".*: ([0-9]+)(us|mks|ms)')
+# Factor to convert elapsed time to μs
+UNIT_FACTOR = {b'us': 1, b'mks': 1, b'ms': 1000}
+
 def main():
     if len(sys.argv) < 2:
         tool = os.path.basename(sys.argv[0])
@@ -16,19 +20,19 @@ def main():
         args += ['--run_test=' + sys.argv[2]]
     p = subprocess.Popen(args, stdout=subprocess.PIPE)
     results = []
-    for line in p.stdout:
-        if not line:
-            break
-        line = line.decode()
-        m = re.match('.*Leaving test case "(.*)".*: ([0-9]+)(us|mks|ms)', line)
-        if m:
-            if m.group(3) == 'ms':
-                elapsed = int(m.group(2)) * 1000
-            else:
-                elapsed = int(m.group(2))
-            results.append((m.group(1), elapsed))
-        sys.stderr.write('.')
+    buf = b''
+    while True:
+        # read whatever is available, and match all complete lines in it at once
+        chunk = p.stdout.read1(65536)
+        buf += chunk
+        end = buf.rfind(b'\n') + 1 if chunk else len(buf)
+        for name, elapsed, unit in LEAVING_TEST_CASE_RE.findall(buf, 0, end):
+            results.append((name.decode(), int(elapsed) * UNIT_FACTOR[unit]))
+        sys.stderr.write('.' * buf.count(b'\n', 0, end))
         sys.stderr.flush()
+        buf = buf[end:]
+        if not chunk:
+            break
     sys.stderr.write('\n')
     sys.stderr.flush()
     rv = p.wait()
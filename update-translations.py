@@ -16,6 +16,9 @@ It will do the following automatically:
 - update git for added translations
 - update build system
 '''
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import contextlib
+from itertools import repeat
 import subprocess
 import re
 import sys
@@ -27,6 +30,8 @@ import xml.etree.ElementTree as ET
 LCONVERT = 'lconvert'
 # Name of transifex tool
 TX = 'tx'
+# Number of parallel downloads for `tx pull`, the fetch is network-bound
+TX_WORKERS = os.getenv('TX_WORKERS', '20')
 # Name of source language file without extension
 SOURCE_LANG = 'bitcoin_en'
 # Directory with locale files
@@ -35,10 +40,14 @@ LOCALE_DIR = 'src/qt/locale'
 MIN_NUM_NONNUMERUS_MESSAGES = 10
 # Regexp to check for Bitcoin addresses
 ADDRESS_REGEXP = re.compile('([13]|bc1)[a-zA-Z0-9]{30,}')
+# Regexp to find format specifiers, a '%' at the end of the string yields an empty match
+FORMAT_SPECIFIER_RE = re.compile(r'%(.|\Z)', re.DOTALL)
+# Regexp to split a translation file name into (filename, basename, language)
+TS_FILENAME_RE = re.compile(r'((bitcoin_(.*))\.ts)$')
 # Path to git
 GIT = os.getenv("GIT", "git")
-# Original content file suffix
-ORIGINAL_SUFFIX = '.orig'
+# Temporary file suffix, for writing the postprocessed content
+TEMP_SUFFIX = '.tmp'
 # Native Qt translation file (TS) format
 FORMAT_TS = '.ts'
 # XLIFF file format
@@ -59,59 +68,50 @@ def remove_current_translations():
     for (_,name) in all_ts_files():
         os.remove(name)
 
-def remove_orig_files():
-    '''
-    Remove temporary files that might be left behind.
-    '''
-    for (_,name) in all_ts_files(suffix=ORIGINAL_SUFFIX):
-        os.remove(name + ORIGINAL_SUFFIX)
-
 def fetch_all_translations():
-    if subprocess.call([TX, 'pull', '--translations', '--force', '--all']):
+    if subprocess.call([TX, 'pull', '--translations', '--force', '--all', '--workers', TX_WORKERS]):
         print('Error while fetching translations', file=sys.stderr)
         sys.exit(1)
 
+def convert_file(name, outname):
+    subprocess.check_call([LCONVERT, '-o', outname, '-i', name])
+    os.remove(name)
+
 def convert_xlf_to_ts():
     xliff_files =  all_ts_files(file_format=FORMAT_XLIFF)
     if not xliff_files:
         return False
 
-    for (_, name) in xliff_files:
-        outname = name.replace(FORMAT_XLIFF, FORMAT_TS)
+    names = [name for (_, name) in xliff_files]
+    outnames = [name.replace(FORMAT_XLIFF, FORMAT_TS) for name in names]
+    for (name, outname) in zip(names, outnames):
         print('Converting %s to %s...' % (name, outname))
-        subprocess.check_call([LCONVERT, '-o', outname, '-i', name])
-        os.remove(name)
+    # every conversion is a separate lconvert process, run them in parallel
+    with ThreadPoolExecutor() as executor:
+        list(executor.map(convert_file, names, outnames))
     return True
 
 def find_format_specifiers(s):
     '''Find all format specifiers in a string.'''
-    pos = 0
-    specifiers = []
-    while True:
-        percent = s.find('%', pos)
-        if percent < 0:
-            break
-        specifiers.append(s[percent+1])
-        pos = percent+2
+    specifiers = FORMAT_SPECIFIER_RE.findall(s)
+    if specifiers and not specifiers[-1]:
+        raise IndexError('format specifier at end of string')
     return specifiers
 
 def split_format_specifiers(specifiers):
     '''Split format specifiers between numeric (Qt) and others (strprintf)'''
     numeric = []
-    other = []
     for s in specifiers:
-        if s in {'1','2','3','4','5','6','7','8','9'}:
+        if s in {'1','2','3','4','5','6','7','8','9'}: # compiled to a frozenset constant
             numeric.append(s)
-        else:
-            other.append(s)
 
     # If both numeric format specifiers and "others" are used, assume we're dealing
     # with a Qt-formatted message. In the case of Qt formatting (see https://doc.qt.io/qt-5/qstring.html#arg)
     # only numeric formats are replaced at all. This means "(percentage: %1%)" is valid, without needing
     # any kind of escaping that would be necessary for strprintf. Without this, this function
     # would wrongly detect '%)' as a printf format specifier.
-    if numeric:
-        other = []
+    # Without numeric format specifiers, all of them are "others".
+    other = [] if numeric else specifiers
 
     # numeric (Qt) can be present in any order, others (strprintf) must be in specified order
     return set(numeric),other
@@ -139,32 +139,59 @@ def check_format_specifiers(source, translation, errors, numerus):
             return False
     return True
 
-def all_ts_files(file_format=FORMAT_TS, suffix='', include_source=False):
+def all_ts_files(file_format=FORMAT_TS, include_source=False):
     for filename in os.listdir(LOCALE_DIR):
         # process only language files, and do not process source language
-        if not filename.endswith(file_format + suffix) or (not include_source and filename == SOURCE_LANG + file_format + suffix):
+        if not filename.endswith(file_format) or (not include_source and filename == SOURCE_LANG + file_format):
             continue
-        if suffix: # remove provided suffix
-            filename = filename[0:-len(suffix)]
         filepath = os.path.join(LOCALE_DIR, filename)
         yield(filename, filepath)
 
-FIX_RE = re.compile(b'[\x00-\x09\x0b\x0c\x0e-\x1f]')
+# Control characters to remove, everything below 0x20 except LF and CR
+INVALID_CHARACTERS = bytes(c for c in range(0x20) if c not in b'\n\r')
 def remove_invalid_characters(s):
     '''Remove invalid characters from translation string'''
-    return FIX_RE.sub(b'', s)
+    return s.translate(None, INVALID_CHARACTERS)
+
+# Escape quotes in text like Qt does (optional, just for cleaner diffs for comparison, disabled by default)
+# Text is everything between a '>' and the next '<', the serializer escapes these within text and attributes
+QUOTED_TEXT_RE = re.compile(b'>[^<\'"]*[\'"][^<]*<')
+def escape_quotes(m):
+    return m.group(0).replace(b"'", b'&apos;').replace(b'"', b'&quot;')
+
+class DiffReducingWriter(io.RawIOBase):
+    '''
+    Write serialized XML to a file, replacing some XML to 'sanitize' to qt formatting on the fly.
+    Data is passed on up to and including the last '<', none of the replacements can span that point.
+    '''
+    def __init__(self, f):
+        self.f = f
+        self.pending = b''
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        data = self.pending + bytes(b)
+        split = data.rfind(b'<') + 1
+        self.pending = data[split:]
+        self.f.write(self.reduce_diff(data[:split]))
+        return len(b)
 
-# Override cdata escape function to make our output match Qt's (optional, just for cleaner diffs for
-# comparison, disable by default)
-_orig_escape_cdata = None
-def escape_cdata(text):
-    text = _orig_escape_cdata(text)
-    text = text.replace("'", '&apos;')
-    text = text.replace('"', '&quot;')
-    return text
+    def close(self):
+        if not self.closed:
+            self.f.write(self.reduce_diff(self.pending))
+            self.pending = b''
+        super().close()
+
+    @staticmethod
+    def reduce_diff(data):
+        data = QUOTED_TEXT_RE.sub(escape_quotes, data)
+        return data.replace(b' />', b'/>')
 
 def contains_bitcoin_addr(text, errors):
-    if text is not None and ADDRESS_REGEXP.search(text) is not None:
+    # any match contains a '1' or '3' (including "bc1"), only run the regexp if there is one
+    if text is not None and ('1' in text or '3' in text) and ADDRESS_REGEXP.search(text) is not None:
         errors.append('Translation "%s" contains a bitcoin address. This will be removed.' % (text))
         return True
     return False
@@ -198,93 +225,102 @@ def postprocess_message(filename, message, xliff_compatible_mode):
             return False
 
     # Remove location tags
-    for location in message.findall('location'):
-        message.remove(location)
+    message[:] = [child for child in message if child.tag != 'location']
 
     return True
 
+def postprocess_file(filename, filepath, xliff_compatible_mode, reduce_diff_hacks):
+    # pre-fixups to cope with transifex output
+    parser = ET.XMLParser(encoding='utf-8') # need to override encoding because 'utf8' is not understood only 'utf-8'
+    with open(filepath, 'rb') as f:
+        data = f.read()
+    # files with too few messages in total will certainly be removed, don't bother parsing them
+    num_messages = data.count(b'<message')
+    if num_messages < MIN_NUM_NONNUMERUS_MESSAGES:
+        print('Removing %s, as it contains only %i messages' % (filepath, num_messages))
+        os.remove(filepath)
+        return
+    # remove control characters; this must be done over the entire file otherwise the XML parser will fail
+    data = remove_invalid_characters(data)
+    tree = ET.parse(io.BytesIO(data), parser=parser)
+
+    # iterate over all messages in file, counting the non-numerus messages that are kept
+    root = tree.getroot()
+    num_nonnumerus_messages = 0
+    for context in root.findall('context'):
+        for message in context.findall('message'):
+            if not postprocess_message(filename, message, xliff_compatible_mode):
+                context.remove(message);
+            elif message.get('numerus') != 'yes':
+                num_nonnumerus_messages += 1
+
+        if context.find('message') is None:
+            root.remove(context)
+
+    # check if document is (virtually) empty, and remove it if so
+    if num_nonnumerus_messages < MIN_NUM_NONNUMERUS_MESSAGES:
+        print('Removing %s, as it contains only %i non-numerus messages' % (filepath, num_nonnumerus_messages))
+        os.remove(filepath)
+        return
+
+    # write fixed-up tree to a temporary file, then replace the original with it
+    # if diff reduction requested, replace some XML to 'sanitize' to qt formatting
+    if reduce_diff_hacks:
+        with open(filepath + TEMP_SUFFIX, 'wb') as f, DiffReducingWriter(f) as out:
+            tree.write(out, encoding='utf-8')
+    else:
+        tree.write(filepath + TEMP_SUFFIX, encoding='utf-8')
+    os.replace(filepath + TEMP_SUFFIX, filepath)
+
+def postprocess_file_output(*args):
+    '''
+    Postprocess a file in a worker process, return what it printed so that the output of
+    files processed in parallel doesn't get interleaved.
+    '''
+    with contextlib.redirect_stdout(io.StringIO()) as out:
+        postprocess_file(*args)
+    return out.getvalue()
+
 def postprocess_translations(xliff_compatible_mode, reduce_diff_hacks=False):
     print('Checking and postprocessing...')
 
-    if reduce_diff_hacks:
-        global _orig_escape_cdata
-        _orig_escape_cdata = ET._escape_cdata
-        ET._escape_cdata = escape_cdata
-
-    for (filename,filepath) in all_ts_files():
-        os.rename(filepath, filepath + ORIGINAL_SUFFIX)
-
-    for (filename,filepath) in all_ts_files(suffix=ORIGINAL_SUFFIX):
-        # pre-fixups to cope with transifex output
-        parser = ET.XMLParser(encoding='utf-8') # need to override encoding because 'utf8' is not understood only 'utf-8'
-        with open(filepath + ORIGINAL_SUFFIX, 'rb') as f:
-            data = f.read()
-        # remove control characters; this must be done over the entire file otherwise the XML parser will fail
-        data = remove_invalid_characters(data)
-        tree = ET.parse(io.BytesIO(data), parser=parser)
-
-        # iterate over all messages in file
-        root = tree.getroot()
-        for context in root.findall('context'):
-            for message in context.findall('message'):
-                if not postprocess_message(filename, message, xliff_compatible_mode):
-                    context.remove(message);
-
-            if not context.findall('message'):
-                root.remove(context)
-
-        # check if document is (virtually) empty, and remove it if so
-        num_nonnumerus_messages = 0
-        for context in root.findall('context'):
-            for message in context.findall('message'):
-                if message.get('numerus') != 'yes':
-                    num_nonnumerus_messages += 1
-
-        if num_nonnumerus_messages < MIN_NUM_NONNUMERUS_MESSAGES:
-            print('Removing %s, as it contains only %i non-numerus messages' % (filepath, num_nonnumerus_messages))
-            continue
-
-        # write fixed-up tree
-        # if diff reduction requested, replace some XML to 'sanitize' to qt formatting
-        if reduce_diff_hacks:
-            out = io.BytesIO()
-            tree.write(out, encoding='utf-8')
-            out = out.getvalue()
-            out = out.replace(b' />', b'/>')
-            with open(filepath, 'wb') as f:
-                f.write(out)
-        else:
-            tree.write(filepath, encoding='utf-8')
+    # files are independent of each other, so process them in parallel
+    files = list(all_ts_files())
+    with ProcessPoolExecutor() as executor:
+        for output in executor.map(postprocess_file_output,
+                [filename for (filename,_) in files], [filepath for (_,filepath) in files],
+                repeat(xliff_compatible_mode), repeat(reduce_diff_hacks)):
+            sys.stdout.write(output)
 
 def update_git():
     '''
     Add new files to git repository.
     (Removing files isn't necessary here, as `git commit -a` will take care of removing files that are gone)
     '''
-    file_paths = [filepath for (filename, filepath) in all_ts_files()]
-    subprocess.check_call([GIT, 'add'] + file_paths)
+    # Pass the paths on stdin, so that the command line length is not a concern
+    file_paths = b''.join(filepath.encode() + b'\0' for (filename, filepath) in all_ts_files())
+    subprocess.run([GIT, 'add', '--pathspec-from-file=-', '--pathspec-file-nul'], input=file_paths, check=True)
 
 def update_build_systems():
     '''
     Update build system and Qt resource descriptors.
     '''
-    filename_lang = [re.match(r'((bitcoin_(.*)).ts)$', filename).groups() for (filename, filepath) in all_ts_files(include_source=True)]
+    filename_lang = [TS_FILENAME_RE.match(filename).groups() for (filename, filepath) in all_ts_files(include_source=True)]
     filename_lang.sort(key=lambda x: x[0])
 
     # update qrc locales
     with open('src/qt/bitcoin_locale.qrc', 'w') as f:
-        f.write('<!DOCTYPE RCC><RCC version="1.0">\n')
-        f.write('    <qresource prefix="/translations">\n')
-        for (filename, basename, lang) in filename_lang:
-            f.write(f'        <file alias="{lang}">locale/{basename}.qm</file>\n')
-        f.write('    </qresource>\n')
-        f.write('</RCC>\n')
+        f.write('<!DOCTYPE RCC><RCC version="1.0">\n' +
+                '    <qresource prefix="/translations">\n' +
+                ''.join(f'        <file alias="{lang}">locale/{basename}.qm</file>\n' for (filename, basename, lang) in filename_lang) +
+                '    </qresource>\n' +
+                '</RCC>\n')
 
     # update Makefile include
     with open('src/Makefile.qt_locale.include', 'w') as f:
-        f.write('QT_TS = \\\n')
-        f.write(' \\\n'.join(f'  qt/locale/{filename}' for (filename, basename, lang) in filename_lang))
-        f.write('\n') # make sure last line doesn't end with a backslash
+        f.write('QT_TS = \\\n' +
+                ' \\\n'.join(f'  qt/locale/{filename}' for (filename, basename, lang) in filename_lang) +
+                '\n') # make sure last line doesn't end with a backslash
 
 if __name__ == '__main__':
     check_at_repository_root()
@@ -294,5 +330,4 @@ if __name__ == '__main__':
     postprocess_translations(xliff_compatible_mode)
     update_git()
     update_build_systems()
-    remove_orig_files()
 